@@ -5,9 +5,13 @@ This script demonstrates how to use various LLMs to generate human-readable
 descriptions of RO-Crate manifests.
 """
 
+import asyncio
+import functools
+import hashlib
 import json
 import os
 from typing import Dict, Any, List
+import httpx
 import openai
 from pathlib import Path
 import sys
@@ -17,95 +21,210 @@ from datetime import datetime
 sys.path.append(str(Path(__file__).parent.parent))
 from utils.token_length import count_tokens, optimize_rocrate_for_llm
 
+# Prefer orjson for manifest parsing (2-5x faster than stdlib json on large crates)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# ijson enables streaming extraction for very large manifests
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Manifests smaller than this are parsed in memory; streaming only pays off above it
+STREAMING_SIZE_THRESHOLD = 5 * 1024 * 1024  # 5 MB
+
+# Maximum number of LLM requests in flight at once (keeps us under rate limits)
+MAX_CONCURRENT_REQUESTS = 8
+
+# On-disk cache of LLM responses keyed by prompt content; identical prompts
+# (common in corpora sharing metadata skeletons) skip the API call entirely
+LLM_CACHE_DIR = Path(__file__).parent.parent / ".llm_cache"
+
+
+@functools.lru_cache(maxsize=128)
+def _load_cached_manifest(filepath: str, mtime: float) -> Dict[str, Any]:
+    """Parse a manifest file, cached by path and modification time."""
+    # Binary mode lets the C JSON parser consume the bytes directly
+    with open(filepath, 'rb') as f:
+        return _json_loads(f.read())
+
 
 def load_rocrate_manifest(filepath: str) -> Dict[str, Any]:
     """Load an RO-Crate manifest from a JSON file."""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return _load_cached_manifest(filepath, os.path.getmtime(filepath))
+
+
+def _has_type(item_type: Any, type_name: str) -> bool:
+    """Check whether an entity @type (string or list) includes the given type."""
+    return item_type == type_name or (isinstance(item_type, list) and type_name in item_type)
 
 
 def extract_key_info(manifest: Dict[str, Any]) -> Dict[str, Any]:
     """Extract key information from an RO-Crate manifest."""
     graph = manifest.get('@graph', [])
-    
-    # Find the root dataset
+
+    # Fast path: well-formed crates conventionally place the root dataset at
+    # the front of @graph, so check there before scanning for it
     root_dataset = None
-    for item in graph:
-        if item.get('@id') == './' and item.get('@type') == 'Dataset':
-            root_dataset = item
-            break
-    
-    if not root_dataset:
+    first = graph[0] if graph else None
+    if first is not None and first.get('@id') == './' and _has_type(first.get('@type'), 'Dataset'):
+        root_dataset = first
+
+    if root_dataset is None:
+        root_dataset = next((item for item in graph
+                             if item.get('@id') == './' and _has_type(item.get('@type'), 'Dataset')),
+                            None)
+
+    # Bail out before counting files; malformed crates shouldn't pay for a scan
+    # whose result is about to be discarded
+    if root_dataset is None:
         return {}
-    
+
+    files_count = sum(1 for item in graph if _has_type(item.get('@type'), 'File'))
+
+    return _build_key_info(root_dataset, files_count)
+
+
+def _normalize_creators(raw_creators: Any) -> List[Dict[str, str]]:
+    """Normalize creator entries to a list of {'name', 'affiliation'} dicts."""
+    if isinstance(raw_creators, dict):
+        raw_creators = [raw_creators]
+
+    creators = []
+    for creator in raw_creators:
+        affiliation = creator.get('affiliation')
+        creators.append({
+            'name': creator.get('name', 'Unknown'),
+            'affiliation': affiliation.get('name', '') if isinstance(affiliation, dict) else ''
+        })
+    return creators
+
+
+# Defaults for root-dataset fields; merged below with a single C-level dict
+# merge rather than a .get call per field
+_KEY_INFO_DEFAULTS = {
+    'name': 'Unnamed Dataset',
+    'description': 'No description provided',
+    'creator': [],
+    'keywords': [],
+    'license': {},
+    'datePublished': 'Unknown',
+    'hasPart': []
+}
+
+
+def _build_key_info(root_dataset: Dict[str, Any], files_count: int) -> Dict[str, Any]:
+    """Build the key-info dict from a root dataset and a file count."""
+    merged = {**_KEY_INFO_DEFAULTS, **root_dataset}
     return {
-        'name': root_dataset.get('name', 'Unnamed Dataset'),
-        'description': root_dataset.get('description', 'No description provided'),
-        'creator': root_dataset.get('creator', []),
-        'keywords': root_dataset.get('keywords', []),
-        'license': root_dataset.get('license', {}),
-        'datePublished': root_dataset.get('datePublished', 'Unknown'),
-        'files_count': len([item for item in graph if item.get('@type') == 'File']),
-        'hasPart': root_dataset.get('hasPart', [])
+        'name': merged['name'],
+        'description': merged['description'],
+        'creator': _normalize_creators(merged['creator']),
+        'keywords': merged['keywords'],
+        'license': merged['license'],
+        'datePublished': merged['datePublished'],
+        'files_count': files_count,
+        'hasPart': merged['hasPart']
     }
 
 
-def generate_description_prompt(key_info: Dict[str, Any], model: str = "gpt-4o") -> str:
-    """Generate a prompt for LLM to describe the RO-Crate."""
-    prompt = f"""
-Please provide a clear, human-readable description of this research object based on the following metadata:
+def extract_key_info_streaming(filepath: str) -> Dict[str, Any]:
+    """Extract key information from a manifest without loading it fully into memory.
 
-Title: {key_info.get('name', 'Unknown')}
-Description: {key_info.get('description', 'No description')}
-Publication Date: {key_info.get('datePublished', 'Unknown')}
-Number of Files: {key_info.get('files_count', 0)}
-Keywords: {', '.join(key_info.get('keywords', []))}
-License: {key_info.get('license', {}).get('@id', 'Not specified')}
+    Streams @graph entities with ijson so peak memory stays constant regardless
+    of manifest size. Small manifests (or environments without ijson) fall back
+    to the in-memory loader, which is faster below the streaming threshold.
+    """
+    if ijson is None or os.path.getsize(filepath) < STREAMING_SIZE_THRESHOLD:
+        return extract_key_info(load_rocrate_manifest(filepath))
 
-Creator(s):
-{format_creators(key_info.get('creator', []))}
+    root_dataset = None
+    files_count = 0
+    with open(filepath, 'rb') as f:
+        for item in ijson.items(f, '@graph.item'):
+            item_type = item.get('@type')
+            if root_dataset is None and item.get('@id') == './' and _has_type(item_type, 'Dataset'):
+                root_dataset = item
+            if _has_type(item_type, 'File'):
+                files_count += 1
 
-Files included:
-{format_files(key_info.get('hasPart', []))}
+    if not root_dataset:
+        return {}
+
+    return _build_key_info(root_dataset, files_count)
+
+
+# Persistent instructions live in the system message. Keeping the string
+# byte-identical across calls lets the provider's prefix caching reuse it.
+_SPECIALIST_ROLE = ("You are a research data specialist who helps researchers understand "
+                    "and discover relevant datasets and research objects.")
 
-Please write a comprehensive summary that would help a researcher understand what this research object contains and its potential value for their work.
+_SYSTEM_PROMPT = (_SPECIALIST_ROLE + " Given RO-Crate metadata, write a clear, comprehensive "
+                  "summary that helps a researcher understand what the research object "
+                  "contains and its potential value for their work.")
+
+# User message carries only the structured metadata; per-manifest fields are
+# filled in with a single format_map call
+_PROMPT_TEMPLATE = """Title: {name}
+Description: {description}
+Published: {date_published}
+Files: {files_count}
+Keywords: {keywords}
+License: {license}
+Creator(s):
+{creators}
+Files included:
+{files}
 """
-    
+
+
+def generate_description_prompt(key_info: Dict[str, Any], model: str = "gpt-4o") -> str:
+    """Generate a prompt for LLM to describe the RO-Crate."""
+    fields = {
+        'name': key_info.get('name', 'Unknown'),
+        'description': key_info.get('description', 'No description'),
+        'date_published': key_info.get('datePublished', 'Unknown'),
+        'files_count': key_info.get('files_count', 0),
+        'keywords': ', '.join(key_info.get('keywords', [])),
+        'license': key_info.get('license', {}).get('@id', 'Not specified'),
+        'creators': format_creators(key_info.get('creator', [])),
+        'files': format_files(key_info.get('hasPart', []))
+    }
+    prompt = _PROMPT_TEMPLATE.format_map(fields)
+
+
     # Check token count and optimize if necessary
-    token_count = count_tokens(prompt, model)
     max_tokens = 120000 if model in ["gpt-4o", "gpt-4-turbo"] else 15000  # Leave room for response
-    
+
+    # Cheap pre-filter: a token is ~3+ characters, so short prompts can't
+    # exceed the limit and don't need to be encoded at all
+    if len(prompt) <= max_tokens * 3:
+        return prompt
+
+    token_count = count_tokens(prompt, model)
     if token_count > max_tokens:
         print(f"⚠️  Prompt too long ({token_count} tokens), optimizing...")
-        prompt = optimize_rocrate_for_llm(prompt, max_tokens, model)
-        new_token_count = count_tokens(prompt, model)
+        # Reuse the count the optimizer already has instead of re-encoding
+        prompt, new_token_count = optimize_rocrate_for_llm(prompt, max_tokens, model,
+                                                           return_token_count=True)
         print(f"   Reduced to {new_token_count} tokens")
     
     return prompt
 
 
-def format_creators(creators: List[Dict[str, Any]]) -> str:
-    """Format creator information for the prompt."""
+def format_creators(creators: List[Dict[str, str]]) -> str:
+    """Format creator information (already normalized by extract_key_info) for the prompt."""
     if not creators:
         return "- Not specified"
-    
-    if isinstance(creators, dict):
-        creators = [creators]
-    
-    formatted = []
-    for creator in creators:
-        name = creator.get('name', 'Unknown')
-        affiliation = creator.get('affiliation', {})
-        if isinstance(affiliation, dict):
-            affiliation_name = affiliation.get('name', '')
-            if affiliation_name:
-                formatted.append(f"- {name} ({affiliation_name})")
-            else:
-                formatted.append(f"- {name}")
-        else:
-            formatted.append(f"- {name}")
-    
-    return '\n'.join(formatted)
+
+    return '\n'.join(
+        f"- {creator['name']} ({creator['affiliation']})" if creator['affiliation']
+        else f"- {creator['name']}"
+        for creator in creators)
 
 
 def format_files(files: List[Dict[str, Any]]) -> str:
@@ -122,102 +241,202 @@ def format_files(files: List[Dict[str, Any]]) -> str:
 
 
 def save_description_to_file(filename: str, description: str, output_dir: Path) -> str:
-    """Save a single description to a file."""
-    output_dir.mkdir(exist_ok=True)
-    
+    """Save a single description to a file. The output directory must already exist."""
     # Create filename based on the RO-Crate name
     safe_filename = filename.replace('.json', '').replace(' ', '_').replace('/', '_')
     output_file = output_dir / f"{safe_filename}_description.txt"
-    
+
+    # Assemble the content in memory and write it with a single call
+    content = (f"RO-Crate Description: {filename}\n"
+               f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+               + "=" * 60 + "\n\n"
+               + description + "\n")
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(f"RO-Crate Description: {filename}\n")
-        f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write("=" * 60 + "\n\n")
-        f.write(description)
-        f.write("\n")
-    
+        f.write(content)
+
     return str(output_file)
 
 
 def save_combined_report(results: List[Dict[str, str]], output_dir: Path, model: str) -> str:
-    """Save a combined report of all descriptions."""
-    output_dir.mkdir(exist_ok=True)
-    
+    """Save a combined report of all descriptions. The output directory must already exist."""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     report_file = output_dir / f"rocrate_analysis_report_{timestamp}.txt"
-    
-    with open(report_file, 'w', encoding='utf-8') as f:
-        f.write("RO-Crate Analysis Report\n")
-        f.write("=" * 50 + "\n")
-        f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"Model used: {model}\n")
-        f.write(f"Total files analyzed: {len(results)}\n")
-        f.write("=" * 50 + "\n\n")
-        
-        for i, result in enumerate(results, 1):
-            f.write(f"\n{i}. Analysis of: {result['filename']}\n")
-            f.write("-" * 60 + "\n")
-            f.write(result['description'])
-            f.write("\n\n")
-        
-        # Add summary
-        f.write("\n" + "=" * 50 + "\n")
-        f.write("SUMMARY\n")
-        f.write("=" * 50 + "\n")
-        
-        successful = len([r for r in results if not r['description'].startswith('Error')])
-        failed = len(results) - successful
-        
-        f.write(f"Successfully analyzed: {successful}/{len(results)} files\n")
-        if failed > 0:
-            f.write(f"Failed to analyze: {failed} files\n")
-            f.write("\nFailed files:\n")
-            for result in results:
-                if result['description'].startswith('Error'):
-                    f.write(f"- {result['filename']}: {result['description'][:100]}...\n")
-    
+
+    # Build the whole report in memory, then write it once
+    parts = [
+        "RO-Crate Analysis Report\n",
+        "=" * 50 + "\n",
+        f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
+        f"Model used: {model}\n",
+        f"Total files analyzed: {len(results)}\n",
+        "=" * 50 + "\n\n",
+    ]
+
+    for i, result in enumerate(results, 1):
+        parts += [f"\n{i}. Analysis of: {result['filename']}\n",
+                  "-" * 60 + "\n",
+                  result['description'],
+                  "\n\n"]
+
+    # Add summary
+    parts += ["\n" + "=" * 50 + "\n",
+              "SUMMARY\n",
+              "=" * 50 + "\n"]
+
+    successful = sum(1 for r in results if not r['description'].startswith('Error'))
+    failed = len(results) - successful
+
+    parts.append(f"Successfully analyzed: {successful}/{len(results)} files\n")
+    if failed > 0:
+        parts.append(f"Failed to analyze: {failed} files\n")
+        parts.append("\nFailed files:\n")
+        for result in results:
+            if result['description'].startswith('Error'):
+                parts.append(f"- {result['filename']}: {result['description'][:100]}...\n")
+
+    # Single write to a temp file, then an atomic rename so a crash mid-write
+    # never leaves a truncated report behind
+    data = ''.join(parts).encode('utf-8')
+    tmp_file = report_file.with_suffix('.tmp')
+    tmp_file.write_bytes(data)
+    os.replace(tmp_file, report_file)
+
     return str(report_file)
 
 
-def analyze_rocrate_with_llm(manifest_path: str, model: str = "gpt-4o") -> str:
-    """Analyze an RO-Crate manifest using an LLM."""
-    # Load API key from api_keys.json
-    try:
-        with open('api_keys.json', 'r') as f:
-            keys = json.load(f)
-            api_key = keys.get('openai_api_key')
-            if not api_key:
-                return "Error: openai_api_key not found in api_keys.json"
-    except FileNotFoundError:
-        return "Error: api_keys.json not found. Please create it with your OpenAI API key."
-    except json.JSONDecodeError:
-        return "Error: Invalid JSON in api_keys.json"
-    
+def load_api_key() -> str:
+    """Load the OpenAI API key from api_keys.json."""
+    with open('api_keys.json', 'r') as f:
+        keys = json.load(f)
+        return keys.get('openai_api_key')
+
+
+def _llm_cache_path(model: str, prompt: str) -> Path:
+    """Build the cache file path for a (model, system prompt, user prompt) triple."""
+    # blake2b is fast on CPU and plenty for non-cryptographic cache keying;
+    # hashing the system prompt too invalidates the cache when it changes
+    key = hashlib.blake2b(f"{_SYSTEM_PROMPT}\x00{prompt}".encode('utf-8'),
+                          digest_size=16).hexdigest()
+    return LLM_CACHE_DIR / f"{model}_{key}.txt"
+
+
+async def analyze_rocrate_with_llm(manifest_path: str, client: openai.AsyncOpenAI,
+                                   semaphore: asyncio.Semaphore, model: str = "gpt-4o",
+                                   echo: bool = False) -> str:
+    """Analyze an RO-Crate manifest using an LLM.
+
+    The completion is streamed so the first tokens are available as soon as
+    the model produces them. With echo=True each chunk is printed as it
+    arrives; leave it off when several analyses run concurrently, or their
+    streams will interleave on stdout.
+    """
     # Load and extract information
     manifest = load_rocrate_manifest(manifest_path)
     key_info = extract_key_info(manifest)
-    
+
     # Generate prompt with optimization
     prompt = generate_description_prompt(key_info, model)
-    
-    # Call LLM
+
+    # Serve bit-identical prompts from the on-disk cache
+    cache_path = _llm_cache_path(model, prompt)
+    if cache_path.exists():
+        return cache_path.read_text(encoding='utf-8')
+
+    # Call LLM (the semaphore bounds how many requests are in flight at once)
     try:
-        client = openai.OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a research data specialist who helps researchers understand and discover relevant datasets and research objects."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
+        async with semaphore:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": _SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=1000,
+                temperature=0.7,
+                stream=True
+            )
+
+            chunks = []
+            async for event in stream:
+                delta = event.choices[0].delta.content or ""
+                if echo:
+                    print(delta, end='', flush=True)
+                chunks.append(delta)
+
+        description = ''.join(chunks)
+        cache_path.parent.mkdir(exist_ok=True)
+        cache_path.write_text(description, encoding='utf-8')
+        return description
     except Exception as e:
         return f"Error calling LLM: {str(e)}"
 
 
+async def analyze_batch(manifest_paths: List[Path], client: openai.AsyncOpenAI,
+                        semaphore: asyncio.Semaphore, model: str = "gpt-4o",
+                        batch_size: int = 5) -> Dict[str, str]:
+    """Analyze several RO-Crates per LLM request to amortize per-call overhead.
+
+    Packs up to batch_size manifests' key info into one user message and asks
+    the model for a JSON object keyed by filename. Batches whose response can't
+    be parsed (or that are missing entries) fall back to one request per file.
+
+    Returns a dict mapping filename to description.
+    """
+    descriptions: Dict[str, str] = {}
+
+    for start in range(0, len(manifest_paths), batch_size):
+        chunk = manifest_paths[start:start + batch_size]
+        payload = {p.name: extract_key_info(load_rocrate_manifest(str(p))) for p in chunk}
+
+        batch_prompt = (
+            "Summarize each of the following research objects for a researcher. "
+            "Respond with a JSON object mapping each filename to its summary.\n\n"
+            "Research objects:\n" + json.dumps(payload, indent=2)
+        )
+
+        parsed: Dict[str, Any] = {}
+        try:
+            async with semaphore:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": _SPECIALIST_ROLE},
+                        {"role": "user", "content": batch_prompt}
+                    ],
+                    response_format={"type": "json_object"},
+                    max_tokens=1000 * len(chunk),
+                    temperature=0.7
+                )
+            parsed = json.loads(response.choices[0].message.content)
+        except Exception:
+            parsed = {}
+
+        # Fall back to per-manifest requests for anything the batch didn't cover
+        missing = [p for p in chunk if not isinstance(parsed.get(p.name), str)]
+        for p in chunk:
+            if p not in missing:
+                descriptions[p.name] = parsed[p.name]
+        if missing:
+            fallbacks = await asyncio.gather(
+                *[analyze_rocrate_with_llm(str(p), client, semaphore, model) for p in missing],
+                return_exceptions=True)
+            for p, description in zip(missing, fallbacks):
+                if isinstance(description, Exception):
+                    description = f"Error calling LLM: {str(description)}"
+                descriptions[p.name] = description
+
+    return descriptions
+
+
+async def analyze_all_rocrates(manifest_files: List[Path], client: openai.AsyncOpenAI,
+                               model: str = "gpt-4o") -> List[Any]:
+    """Analyze all manifests concurrently, preserving input order in the results."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    tasks = [analyze_rocrate_with_llm(str(manifest_file), client, semaphore, model)
+             for manifest_file in manifest_files]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
 def main():
     """Run the experiment on sample RO-Crate manifests."""
     # Configuration
@@ -232,36 +451,57 @@ def main():
     print(f"📁 Analyzing RO-Crate files in: {examples_dir}")
     if save_output:
         print(f"💾 Saving outputs to: {output_dir}")
-    
+        output_dir.mkdir(exist_ok=True)
+
+    # Load API key from api_keys.json
+    try:
+        api_key = load_api_key()
+        if not api_key:
+            print("Error: openai_api_key not found in api_keys.json")
+            return
+    except FileNotFoundError:
+        print("Error: api_keys.json not found. Please create it with your OpenAI API key.")
+        return
+    except json.JSONDecodeError:
+        print("Error: Invalid JSON in api_keys.json")
+        return
+
+    # One shared client so all requests reuse the same warm connection pool
+    # (keep-alive avoids a fresh TCP + TLS handshake per manifest)
+    client = openai.AsyncOpenAI(
+        api_key=api_key,
+        max_retries=2,
+        timeout=30.0,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=20))
+    )
+
+    manifest_files = sorted(examples_dir.glob("*.json"))
+    print(f"\n🚀 Dispatching {len(manifest_files)} analyses "
+          f"(up to {MAX_CONCURRENT_REQUESTS} concurrent requests)...")
+    descriptions = asyncio.run(analyze_all_rocrates(manifest_files, client, model))
+
     results = []
-    
-    for manifest_file in examples_dir.glob("*.json"):
+
+    for manifest_file, description in zip(manifest_files, descriptions):
         print(f"\n{'='*60}")
         print(f"Analyzing: {manifest_file.name}")
         print(f"{'='*60}")
-        
-        try:
-            description = analyze_rocrate_with_llm(str(manifest_file), model)
-            print(description)
-            
-            # Store result for saving
-            results.append({
-                'filename': manifest_file.name,
-                'description': description
-            })
-            
-            # Save individual file if requested
-            if save_output:
-                output_file = save_description_to_file(manifest_file.name, description, output_dir)
-                print(f"\n💾 Saved to: {output_file}")
-                
-        except Exception as e:
-            error_msg = f"Error processing {manifest_file.name}: {str(e)}"
-            print(error_msg)
-            results.append({
-                'filename': manifest_file.name,
-                'description': error_msg
-            })
+
+        if isinstance(description, Exception):
+            description = f"Error processing {manifest_file.name}: {str(description)}"
+        print(description)
+
+        # Store result for saving
+        results.append({
+            'filename': manifest_file.name,
+            'description': description
+        })
+
+        # Save individual file if requested
+        if save_output:
+            output_file = save_description_to_file(manifest_file.name, description, output_dir)
+            print(f"\n💾 Saved to: {output_file}")
     
     # Save combined report
     if save_output and results:
@@ -269,7 +509,7 @@ def main():
         print(f"\n📋 Combined report saved to: {report_file}")
         
         # Print summary
-        successful = len([r for r in results if not r['description'].startswith('Error')])
+        successful = sum(1 for r in results if not r['description'].startswith('Error'))
         print(f"\n📊 Summary: {successful}/{len(results)} files successfully analyzed")
     
     print(f"\n✅ Analysis complete!")
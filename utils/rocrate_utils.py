@@ -4,65 +4,136 @@ Utility functions for working with RO-Crate manifests.
 
 import json
 import jsonschema
+from collections import OrderedDict, defaultdict
 from typing import Dict, Any, List, Optional
 from pathlib import Path
 
+# Prefer orjson for manifest parsing; it parses straight from bytes in C and
+# is several times faster than stdlib json on large crates
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Top-level structural schema for RO-Crate manifests, compiled to a validator
+# once at import time; entity-level checks stay in validate_rocrate_structure
+_ROCRATE_SCHEMA = {
+    "type": "object",
+    "required": ["@context", "@graph"],
+    "properties": {
+        "@context": {"const": "https://w3id.org/ro/crate/1.1/context"},
+        "@graph": {"type": "array"},
+    },
+}
+_SCHEMA_VALIDATOR = jsonschema.Draft7Validator(_ROCRATE_SCHEMA)
+
+# Translate schema errors back into the issue strings this module has always
+# reported, keyed by (validator keyword, offending property)
+_SCHEMA_ISSUE_MESSAGES = {
+    ('required', '@context'): "Missing @context",
+    ('const', '@context'): "Unexpected @context value",
+    ('required', '@graph'): "Missing @graph",
+    ('type', '@graph'): "@graph should be a list",
+}
+
+
+def _as_list(value: Any) -> Any:
+    """Normalize an @type value (bare string or list) to an iterable of strings.
+
+    Bare strings are wrapped in a tuple — cheaper to allocate than a list —
+    and the exact-type check skips the MRO walk isinstance would do. Lists
+    pass through untouched, so the common case allocates nothing.
+    """
+    return (value,) if type(value) is str else value
+
 
 class ROCrateAnalyzer:
     """Analyzer for RO-Crate manifests."""
-    
+
     def __init__(self, manifest_path: str):
         """Initialize with a path to an RO-Crate manifest."""
         self.manifest_path = Path(manifest_path)
         self.manifest = self._load_manifest()
         self.graph = self.manifest.get('@graph', [])
-    
+        self._summary_stats: Optional[Dict[str, Any]] = None
+        self._build_indexes()
+
+    @classmethod
+    def from_manifest(cls, manifest: Dict[str, Any]) -> 'ROCrateAnalyzer':
+        """Build an analyzer around an already-parsed manifest dict."""
+        analyzer = cls.__new__(cls)
+        analyzer.manifest_path = None
+        analyzer.manifest = manifest
+        analyzer.graph = manifest.get('@graph', [])
+        analyzer._summary_stats = None
+        analyzer._build_indexes()
+        return analyzer
+
     def _load_manifest(self) -> Dict[str, Any]:
         """Load the RO-Crate manifest from file."""
-        with open(self.manifest_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
+        # Reading bytes skips the text-mode decode; the parser handles UTF-8 itself
+        return _json_loads(self.manifest_path.read_bytes())
+
+    def _build_indexes(self) -> None:
+        """Index graph entities by @id and by @type in a single traversal.
+
+        Lookups that previously scanned the whole graph (root dataset, files,
+        people, type counts) become dict accesses against these indexes.
+        """
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._by_type: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+
+        for item in self.graph:
+            if not isinstance(item, dict):
+                continue
+            item_id = item.get('@id')
+            if item_id is not None and item_id not in self._by_id:
+                self._by_id[item_id] = item
+            for type_name in _as_list(item.get('@type', [])):
+                self._by_type[type_name].append(item)
+
     def get_root_dataset(self) -> Optional[Dict[str, Any]]:
         """Get the root dataset from the manifest."""
-        for item in self.graph:
-            if item.get('@id') == './' and 'Dataset' in item.get('@type', []):
-                return item
+        item = self._by_id.get('./')
+        if item is not None and 'Dataset' in _as_list(item.get('@type', [])):
+            return item
         return None
-    
+
     def get_files(self) -> List[Dict[str, Any]]:
         """Get all files from the manifest."""
-        return [item for item in self.graph if 'File' in item.get('@type', [])]
-    
+        return self._by_type.get('File', [])
+
     def get_people(self) -> List[Dict[str, Any]]:
         """Get all people from the manifest."""
-        return [item for item in self.graph if 'Person' in item.get('@type', [])]
-    
+        return self._by_type.get('Person', [])
+
     def get_organizations(self) -> List[Dict[str, Any]]:
         """Get all organizations from the manifest."""
-        return [item for item in self.graph if 'Organization' in item.get('@type', [])]
-    
+        return self._by_type.get('Organization', [])
+
     def count_entities_by_type(self) -> Dict[str, int]:
         """Count entities by their @type."""
-        type_counts = {}
-        for item in self.graph:
-            item_types = item.get('@type', [])
-            if isinstance(item_types, str):
-                item_types = [item_types]
-            
-            for type_name in item_types:
-                type_counts[type_name] = type_counts.get(type_name, 0) + 1
-        
-        return type_counts
+        return {type_name: len(items) for type_name, items in self._by_type.items()}
     
     def get_summary_stats(self) -> Dict[str, Any]:
-        """Get summary statistics about the RO-Crate."""
+        """Get summary statistics about the RO-Crate.
+
+        All figures come straight from the indexes built at load time, so no
+        graph traversal happens here. The result is memoized; that is safe
+        because the manifest is never mutated after loading.
+        """
+        if self._summary_stats is not None:
+            return self._summary_stats
+
         root_dataset = self.get_root_dataset()
-        
-        return {
+        by_type = self._by_type
+
+        self._summary_stats = {
             'total_entities': len(self.graph),
-            'files_count': len(self.get_files()),
-            'people_count': len(self.get_people()),
-            'organizations_count': len(self.get_organizations()),
+            'files_count': len(by_type.get('File', ())),
+            'people_count': len(by_type.get('Person', ())),
+            'organizations_count': len(by_type.get('Organization', ())),
             'has_root_dataset': root_dataset is not None,
             'entity_types': self.count_entities_by_type(),
             'name': root_dataset.get('name') if root_dataset else None,
@@ -71,6 +142,7 @@ class ROCrateAnalyzer:
             'has_license': bool(root_dataset.get('license')) if root_dataset else False,
             'has_date_published': bool(root_dataset.get('datePublished')) if root_dataset else False
         }
+        return self._summary_stats
     
     def extract_text_for_llm(self) -> str:
         """Extract all text content suitable for LLM processing."""
@@ -79,20 +151,17 @@ class ROCrateAnalyzer:
             return "No root dataset found in this RO-Crate."
         
         text_parts = []
-        
-        # Basic information
-        if root_dataset.get('name'):
-            text_parts.append(f"Dataset Name: {root_dataset['name']}")
-        
-        if root_dataset.get('description'):
-            text_parts.append(f"Description: {root_dataset['description']}")
-        
-        if root_dataset.get('keywords'):
-            keywords = ', '.join(root_dataset['keywords'])
-            text_parts.append(f"Keywords: {keywords}")
-        
-        if root_dataset.get('datePublished'):
-            text_parts.append(f"Published: {root_dataset['datePublished']}")
+
+        # Basic information, emitted in a fixed order via one table-driven loop
+        for label, key in (('Dataset Name', 'name'),
+                           ('Description', 'description'),
+                           ('Keywords', 'keywords'),
+                           ('Published', 'datePublished')):
+            value = root_dataset.get(key)
+            if value:
+                if key == 'keywords':
+                    value = ', '.join(value)
+                text_parts.append(f"{label}: {value}")
         
         # License information
         license_info = root_dataset.get('license', {})
@@ -112,25 +181,21 @@ class ROCrateAnalyzer:
             
             text_parts.append(f"Creators: {', '.join(creator_names)}")
         
-        # File information
-        files = self.get_files()
-        if files:
-            text_parts.append(f"Number of files: {len(files)}")
-            
-            file_descriptions = []
+        # File information; read the type index directly so only the first 10
+        # entries are ever touched, however many files the crate holds
+        files = self._by_type.get('File', ())
+        n_files = len(files)
+        if n_files:
+            text_parts.append(f"Number of files: {n_files}")
+            text_parts.append("Files included:")
             for file_item in files[:10]:  # Limit to first 10 files
                 file_name = file_item.get('name', file_item.get('@id', 'Unknown'))
-                if file_item.get('description'):
-                    file_descriptions.append(f"- {file_name}: {file_item['description']}")
-                else:
-                    file_descriptions.append(f"- {file_name}")
-            
-            if file_descriptions:
-                text_parts.append("Files included:")
-                text_parts.extend(file_descriptions)
-                
-                if len(files) > 10:
-                    text_parts.append(f"... and {len(files) - 10} more files")
+                description = file_item.get('description')
+                text_parts.append(f"- {file_name}: {description}" if description
+                                  else f"- {file_name}")
+
+            if n_files > 10:
+                text_parts.append(f"... and {n_files - 10} more files")
         
         return '\n'.join(text_parts)
 
@@ -138,30 +203,36 @@ class ROCrateAnalyzer:
 def validate_rocrate_structure(manifest: Dict[str, Any]) -> List[str]:
     """Validate basic RO-Crate structure and return any issues found."""
     issues = []
-    
-    # Check for required @context
-    if '@context' not in manifest:
-        issues.append("Missing @context")
-    elif manifest['@context'] != "https://w3id.org/ro/crate/1.1/context":
-        issues.append("Unexpected @context value")
-    
-    # Check for @graph
-    if '@graph' not in manifest:
-        issues.append("Missing @graph")
-        return issues
-    
-    graph = manifest['@graph']
+
+    # Top-level shape checks run through the compiled Draft-7 validator; each
+    # schema error is translated back into the established issue strings
+    for error in _SCHEMA_VALIDATOR.iter_errors(manifest):
+        if error.validator == 'required':
+            for key in ('@context', '@graph'):
+                if key in error.message:
+                    issues.append(_SCHEMA_ISSUE_MESSAGES[('required', key)])
+        else:
+            path = error.path[0] if error.path else None
+            issues.append(_SCHEMA_ISSUE_MESSAGES.get((error.validator, path),
+                                                     error.message))
+
+    graph = manifest.get('@graph')
     if not isinstance(graph, list):
-        issues.append("@graph should be a list")
+        # Entity-level checks need a usable graph; the schema errors above
+        # already explain what is wrong
         return issues
-    
-    # Check for metadata descriptor
-    metadata_descriptor = None
+
+
+    # Index entities by @id once; the descriptor and root-dataset checks below
+    # become lookups instead of separate scans
+    by_id: Dict[str, Dict[str, Any]] = {}
     for item in graph:
-        if item.get('@id') == 'ro-crate-metadata.json':
-            metadata_descriptor = item
-            break
-    
+        if isinstance(item, dict) and item.get('@id') is not None:
+            by_id.setdefault(item['@id'], item)
+
+    # Check for metadata descriptor
+    metadata_descriptor = by_id.get('ro-crate-metadata.json')
+
     if not metadata_descriptor:
         issues.append("Missing ro-crate-metadata.json descriptor")
     else:
@@ -173,27 +244,40 @@ def validate_rocrate_structure(manifest: Dict[str, Any]) -> List[str]:
             issues.append("Metadata descriptor should conform to RO-Crate 1.1")
     
     # Check for root dataset
-    root_dataset = None
-    for item in graph:
-        if item.get('@id') == './' and 'Dataset' in item.get('@type', []):
-            root_dataset = item
-            break
-    
-    if not root_dataset:
+    root_dataset = by_id.get('./')
+    if not root_dataset or 'Dataset' not in _as_list(root_dataset.get('@type', [])):
         issues.append("Missing root dataset (./ with @type Dataset)")
     
     return issues
 
 
+# Analyzers built for compare_rocrates, cached per manifest object so that
+# pairwise comparisons over M unique manifests build M analyzers, not N^2.
+# A small LRU bounds memory; each entry keeps its manifest alive, so a live
+# entry's id can never be recycled, and the identity check below rebuilds if
+# an id is reused after eviction.
+_ANALYZER_CACHE: 'OrderedDict[int, ROCrateAnalyzer]' = OrderedDict()
+_ANALYZER_CACHE_SIZE = 32
+
+
+def _analyzer_for(manifest: Dict[str, Any]) -> ROCrateAnalyzer:
+    """Get (or build and cache) the analyzer wrapping a manifest dict."""
+    key = id(manifest)
+    analyzer = _ANALYZER_CACHE.get(key)
+    if analyzer is None or analyzer.manifest is not manifest:
+        analyzer = ROCrateAnalyzer.from_manifest(manifest)
+        _ANALYZER_CACHE[key] = analyzer
+        if len(_ANALYZER_CACHE) > _ANALYZER_CACHE_SIZE:
+            _ANALYZER_CACHE.popitem(last=False)
+    else:
+        _ANALYZER_CACHE.move_to_end(key)
+    return analyzer
+
+
 def compare_rocrates(manifest1: Dict[str, Any], manifest2: Dict[str, Any]) -> Dict[str, Any]:
     """Compare two RO-Crate manifests and return differences."""
-    analyzer1 = ROCrateAnalyzer.__new__(ROCrateAnalyzer)
-    analyzer1.manifest = manifest1
-    analyzer1.graph = manifest1.get('@graph', [])
-    
-    analyzer2 = ROCrateAnalyzer.__new__(ROCrateAnalyzer)
-    analyzer2.manifest = manifest2
-    analyzer2.graph = manifest2.get('@graph', [])
+    analyzer1 = _analyzer_for(manifest1)
+    analyzer2 = _analyzer_for(manifest2)
     
     stats1 = analyzer1.get_summary_stats()
     stats2 = analyzer2.get_summary_stats()
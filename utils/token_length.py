@@ -2,49 +2,118 @@
 Utility functions for working with token lengths and LLM inputs.
 """
 
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import tiktoken
 from typing import List, Dict, Any, Optional
 
+# Encodings are expensive to construct (the BPE tables run to several MB), so
+# cache them per model. A plain dict beats lru_cache here: reads are lock-free
+# and skip the argument-hashing machinery on every hot-path call.
+_ENCODING_CACHE: Dict[str, tiktoken.Encoding] = {}
+
+# Lines containing any of these markers are always kept when optimizing
+# RO-Crate text; built once instead of per loop iteration
+_IMPORTANT_KEYWORDS = ('dataset name:', 'description:', 'keywords:', 'creators:',
+                       'published:', 'license:', 'number of files:')
+_MIN_KEYWORD_LEN = min(len(keyword) for keyword in _IMPORTANT_KEYWORDS)
+
+# Below this many texts a single encode_batch call wins; above it, sharding
+# across executor threads avoids contention inside the tokenizer
+_SHARDED_ENCODE_MIN_TEXTS = 64
+
+# Inputs at or below this many characters are tokenized in one call; larger
+# inputs are streamed window-by-window to bound peak memory
+_STREAM_CHAR_THRESHOLD = 1_000_000
+_STREAM_WINDOW_CHARS = 256_000
+
+# Strings below this length go through the memoized token counter; chat
+# histories repeat roles, names and short prefixes verbatim, and capping the
+# length keeps the cache from filling with large one-off payloads
+_SHORT_STRING_CACHE_CHARS = 256
+
+
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """Get the tiktoken encoding for a model, cached so it is built only once."""
+    encoding = _ENCODING_CACHE.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Fallback to a default encoding if model not found
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _ENCODING_CACHE[model] = encoding
+    return encoding
 
-def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo", *,
+                 encoding: Optional[tiktoken.Encoding] = None) -> int:
     """
     Count the number of tokens in a text string for a given model.
-    
+
     Args:
         text: The text to count tokens for
         model: The model name to use for tokenization
-        
+        encoding: Pass a pre-fetched encoding to skip the cache lookup
+            entirely; hot loops should fetch it once and reuse it
+
     Returns:
         Number of tokens in the text
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
-    except KeyError:
-        # Fallback to a default encoding if model not found
-        encoding = tiktoken.get_encoding("cl100k_base")
-        return len(encoding.encode(text))
+    enc = encoding or _ENCODING_CACHE.get(model) or _get_encoding(model)
+    return len(enc.encode(text))
+
+
+def count_tokens_fast(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """
+    Count tokens without scanning the text for special tokens.
+
+    Uses encode_ordinary, which skips the special-token pass, making it
+    faster than count_tokens for plain prose such as RO-Crate text.
+
+    Args:
+        text: The text to count tokens for
+        model: The model name to use for tokenization
+
+    Returns:
+        Number of tokens in the text
+    """
+    return len(_get_encoding(model).encode_ordinary(text))
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_count(model: str, text: str) -> int:
+    """Token count memoized by (model, text) for repeated-probe workloads."""
+    return len(_get_encoding(model).encode_ordinary(text))
+
 
+@functools.lru_cache(maxsize=4096)
+def _ntokens(model: str, text: str) -> int:
+    """Token count for short strings, memoized so repeats never re-tokenize."""
+    return len(_get_encoding(model).encode_ordinary(text))
 
-def truncate_text_to_tokens(text: str, max_tokens: int, model: str = "gpt-3.5-turbo") -> str:
+
+def truncate_text_to_tokens(text: str, max_tokens: int, model: str = "gpt-3.5-turbo", *,
+                            encoding: Optional[tiktoken.Encoding] = None) -> str:
     """
     Truncate text to fit within a maximum token count.
-    
+
     Args:
         text: The text to truncate
         max_tokens: Maximum number of tokens allowed
         model: The model name to use for tokenization
-        
+        encoding: Pass a pre-fetched encoding to skip the cache lookup
+
     Returns:
         Truncated text that fits within the token limit
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    
+    encoding = encoding or _ENCODING_CACHE.get(model) or _get_encoding(model)
+
     tokens = encoding.encode(text)
-    
+
     if len(tokens) <= max_tokens:
         return text
     
@@ -63,22 +132,32 @@ def estimate_prompt_tokens(messages: List[Dict[str, str]], model: str = "gpt-3.5
     Returns:
         Estimated total token count
     """
+    # Short strings (roles, names, repeated prefixes) hit the memoized
+    # counter; everything longer is gathered and tokenized in one batched
+    # call rather than crossing into the tokenizer once per message
     total_tokens = 0
-    
+    strings = []
     for message in messages:
-        # Add tokens for the message content
-        content = message.get('content', '')
-        total_tokens += count_tokens(content, model)
-        
-        # Add overhead tokens for message formatting
-        # This is an approximation based on OpenAI's token counting
-        total_tokens += 4  # Every message follows <im_start>{role/name}\n{content}<im_end>\n
-        
-        if message.get('name'):
-            total_tokens += count_tokens(message['name'], model)
-    
+        for text in (message.get('content', ''), message.get('name')):
+            if not text:
+                continue
+            if len(text) < _SHORT_STRING_CACHE_CHARS:
+                total_tokens += _ntokens(model, text)
+            else:
+                strings.append(text)
+
+    if strings:
+        encoding = _get_encoding(model)
+        token_lists = encoding.encode_batch(strings, num_threads=os.cpu_count() or 1)
+        lens = np.fromiter((len(tokens) for tokens in token_lists),
+                           dtype=np.int32, count=len(strings))
+        total_tokens += int(lens.sum())
+
+    # Add overhead tokens for message formatting
+    # This is an approximation based on OpenAI's token counting
+    total_tokens += 4 * len(messages)  # Every message follows <im_start>{role/name}\n{content}<im_end>\n
     total_tokens += 2  # Every reply is primed with <im_start>assistant
-    
+
     return total_tokens
 
 
@@ -96,27 +175,101 @@ def chunk_text_by_tokens(text: str, chunk_size: int, overlap: int = 0,
     Returns:
         List of text chunks
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    
+    # Very large inputs go through the streaming chunker to bound peak memory
+    if len(text) > _STREAM_CHAR_THRESHOLD:
+        return list(chunk_text_by_tokens_iter(text, chunk_size, overlap, model))
+
+    encoding = _get_encoding(model)
+
     tokens = encoding.encode(text)
-    chunks = []
-    
-    start = 0
-    while start < len(tokens):
-        end = min(start + chunk_size, len(tokens))
-        chunk_tokens = tokens[start:end]
-        chunk_text = encoding.decode(chunk_tokens)
-        chunks.append(chunk_text)
-        
-        if end >= len(tokens):
+    if not tokens:
+        return []
+
+    # Keep the token ids in one contiguous buffer; chunk boundaries are
+    # computed vectorized and each slice below is an O(1) view, not a copy
+    token_array = np.asarray(tokens, dtype=np.int32)
+    starts = np.arange(0, len(token_array), chunk_size - overlap)
+    ends = np.minimum(starts + chunk_size, len(token_array))
+
+    # Stop at the first chunk that reaches the end of the token stream
+    last = int(np.argmax(ends == len(token_array)))
+    starts, ends = starts[:last + 1], ends[:last + 1]
+
+    return [encoding.decode(token_array[start:end].tolist())
+            for start, end in zip(starts, ends)]
+
+
+def chunk_text_by_tokens_iter(text: str, chunk_size: int, overlap: int = 0,
+                              model: str = "gpt-3.5-turbo"):
+    """
+    Stream text chunks by token count without materializing all tokens at once.
+
+    The text is tokenized one character window at a time (windows split on
+    whitespace so tokens aren't cut mid-word) and chunks are yielded as soon
+    as enough tokens accumulate, so peak memory is proportional to the window
+    size rather than the input. For pathological inputs with no whitespace the
+    chunking can differ slightly from the one-shot tokenization at window
+    boundaries.
+
+    Args:
+        text: The text to chunk
+        chunk_size: Maximum tokens per chunk
+        overlap: Number of tokens to overlap between chunks
+        model: The model name to use for tokenization
+
+    Yields:
+        Text chunks of up to chunk_size tokens
+    """
+    encoding = _get_encoding(model)
+    step = chunk_size - overlap
+
+    buffer: List[int] = []
+    pos = 0
+    n = len(text)
+
+    while pos < n:
+        cut = min(pos + _STREAM_WINDOW_CHARS, n)
+        # Prefer a whitespace boundary so the window break doesn't split a token
+        if cut < n:
+            whitespace = text.rfind(' ', pos + 1, cut)
+            if whitespace > pos:
+                cut = whitespace
+        buffer.extend(encoding.encode_ordinary(text[pos:cut]))
+        pos = cut
+
+        # Emit full chunks while more text remains, retaining the overlap
+        while pos < n and len(buffer) >= chunk_size:
+            yield encoding.decode(buffer[:chunk_size])
+            buffer = buffer[step:]
+
+    # Flush the tail with the same stop condition as the list-based chunker
+    while buffer:
+        end = min(chunk_size, len(buffer))
+        yield encoding.decode(buffer[:end])
+        if end >= len(buffer):
             break
-            
-        start = end - overlap
-    
-    return chunks
+        buffer = buffer[step:]
+
+
+def _batch_token_counts(texts: List[str], encoding: tiktoken.Encoding) -> List[int]:
+    """Tokenize texts and return per-text token counts.
+
+    Small lists go through one multi-threaded encode_batch call. Large lists
+    are split into one shard per core, each encoded by a single-threaded
+    encode_batch on its own executor thread, which avoids lock contention
+    inside the tokenizer; order is preserved when merging.
+    """
+    workers = os.cpu_count() or 1
+    if len(texts) < _SHARDED_ENCODE_MIN_TEXTS or workers == 1:
+        token_lists = encoding.encode_batch(texts, num_threads=workers)
+        return [len(tokens) for tokens in token_lists]
+
+    shard_size = -(-len(texts) // workers)  # ceil division
+    shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        shard_results = executor.map(
+            lambda shard: encoding.encode_batch(shard, num_threads=1), shards)
+        return [len(tokens) for shard in shard_results for tokens in shard]
 
 
 def analyze_token_distribution(texts: List[str], model: str = "gpt-3.5-turbo") -> Dict[str, Any]:
@@ -130,74 +283,102 @@ def analyze_token_distribution(texts: List[str], model: str = "gpt-3.5-turbo") -
     Returns:
         Dictionary with token statistics
     """
-    token_counts = [count_tokens(text, model) for text in texts]
-    
-    if not token_counts:
+    if not texts:
         return {}
-    
+
+    encoding = _get_encoding(model)
+
+    # Reduce over a contiguous int64 buffer; np.partition finds the median in
+    # linear time instead of sorting a full copy
+    counts = np.fromiter(_batch_token_counts(texts, encoding),
+                         dtype=np.int64, count=len(texts))
+    total_tokens = int(counts.sum())
+    half = counts.size // 2
+
     return {
         'total_texts': len(texts),
-        'total_tokens': sum(token_counts),
-        'average_tokens': sum(token_counts) / len(token_counts),
-        'min_tokens': min(token_counts),
-        'max_tokens': max(token_counts),
-        'median_tokens': sorted(token_counts)[len(token_counts) // 2],
-        'token_counts': token_counts
+        'total_tokens': total_tokens,
+        'average_tokens': total_tokens / counts.size,
+        'min_tokens': int(counts.min()),
+        'max_tokens': int(counts.max()),
+        'median_tokens': int(np.partition(counts, half)[half]),
+        'token_counts': counts.tolist()
     }
 
 
-def optimize_rocrate_for_llm(rocrate_text: str, max_tokens: int = 4000, 
-                           model: str = "gpt-3.5-turbo") -> str:
+def optimize_rocrate_for_llm(rocrate_text: str, max_tokens: int = 4000,
+                           model: str = "gpt-3.5-turbo",
+                           return_token_count: bool = False):
     """
     Optimize RO-Crate text for LLM processing by truncating if necessary.
-    
+
     Args:
         rocrate_text: The RO-Crate text to optimize
         max_tokens: Maximum tokens allowed
         model: The model name to use for tokenization
-        
+        return_token_count: If True, return (text, token_count) so callers
+            don't have to re-encode the result just to report its size
+
     Returns:
-        Optimized text suitable for LLM processing
+        Optimized text suitable for LLM processing, or a (text, token_count)
+        tuple when return_token_count is True
     """
-    current_tokens = count_tokens(rocrate_text, model)
-    
+    encoding = _get_encoding(model)
+    current_tokens = count_tokens(rocrate_text, model, encoding=encoding)
+
     if current_tokens <= max_tokens:
-        return rocrate_text
-    
+        return (rocrate_text, current_tokens) if return_token_count else rocrate_text
+
     # If too long, try to intelligently truncate
-    lines = rocrate_text.split('\n')
-    
-    # Keep important lines (those with key information)
-    important_lines = []
-    other_lines = []
-    
-    for line in lines:
+    lines = rocrate_text.splitlines()
+
+    # Tokenize every line with one batched call; each count gets +1 for the
+    # joining newline, so the running total never needs a re-tokenization
+    line_token_lists = encoding.encode_batch(lines, num_threads=os.cpu_count() or 1)
+    line_tokens = [len(tokens) + 1 for tokens in line_token_lists]
+
+    # Partition line indices into important (those with key information) and other
+    important_idx = []
+    other_idx = []
+
+    for i, line in enumerate(lines):
+        # Whitespace-only lines add tokens but carry no information; drop them
+        if not line.strip():
+            continue
+        # Lines shorter than the shortest keyword can't match; skip the
+        # lowercase copy and the substring scans entirely
+        if len(line) < _MIN_KEYWORD_LEN:
+            other_idx.append(i)
+            continue
         line_lower = line.lower()
-        if any(keyword in line_lower for keyword in [
-            'dataset name:', 'description:', 'keywords:', 'creators:', 
-            'published:', 'license:', 'number of files:'
-        ]):
-            important_lines.append(line)
+        if any(keyword in line_lower for keyword in _IMPORTANT_KEYWORDS):
+            important_idx.append(i)
         else:
-            other_lines.append(line)
-    
+            other_idx.append(i)
+
     # Start with important lines
-    result_lines = important_lines[:]
-    
+    selected_idx = important_idx[:]
+    running_tokens = sum(line_tokens[i] for i in important_idx)
+
     # Add other lines until we hit the token limit
-    for line in other_lines:
-        test_text = '\n'.join(result_lines + [line])
-        if count_tokens(test_text, model) > max_tokens:
+    for i in other_idx:
+        if running_tokens + line_tokens[i] > max_tokens:
             break
-        result_lines.append(line)
-    
-    optimized_text = '\n'.join(result_lines)
-    
+        selected_idx.append(i)
+        running_tokens += line_tokens[i]
+
+    # One join over a materialized list; str.join buffers generators into a
+    # list internally anyway, so building it here skips that extra pass
+    optimized_text = '\n'.join([lines[i] for i in selected_idx])
+
     # If still too long, truncate
-    if count_tokens(optimized_text, model) > max_tokens:
-        optimized_text = truncate_text_to_tokens(optimized_text, max_tokens, model)
-    
-    return optimized_text
+    optimized_tokens = count_tokens(optimized_text, model, encoding=encoding)
+    if optimized_tokens > max_tokens:
+        optimized_text = truncate_text_to_tokens(optimized_text, max_tokens, model,
+                                                 encoding=encoding)
+        optimized_tokens = max_tokens
+
+    return (optimized_text, optimized_tokens) if return_token_count else optimized_text
 
 
 class TokenBudgetManager:
@@ -243,9 +424,14 @@ class TokenBudgetManager:
         return self.allocations.get(component, 0)
     
     def can_fit(self, text: str) -> bool:
-        """Check if text fits in remaining budget."""
-        tokens_needed = count_tokens(text, self.model)
-        return tokens_needed <= self.get_remaining()
+        """Check if text fits in remaining budget.
+
+        Counts are memoized by (model, text), so probing the same templated
+        fragment repeatedly — the common budget-planning pattern — only
+        tokenizes it once. Avoid probing huge one-off texts in a loop, as
+        each distinct string occupies a cache slot.
+        """
+        return _cached_count(self.model, text) <= self.get_remaining()
     
     def get_budget_summary(self) -> Dict[str, Any]:
         """Get a summary of the budget allocation."""
@@ -256,3 +442,12 @@ class TokenBudgetManager:
             'utilization_percent': (self.used_tokens / self.total_budget) * 100,
             'allocations': self.allocations.copy()
         }
+
+
+# Pre-warm the default model's encoding at import time so the first real
+# tokenization call doesn't pay the construction cost
+try:
+    _get_encoding("gpt-3.5-turbo")
+except Exception:
+    # Never let warm-up failures (e.g. no network for vocab download) break imports
+    pass